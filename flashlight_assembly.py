@@ -1,218 +1,628 @@
+import argparse
+import hashlib
+import json
 import math
-from robodk import *
-from robodk.robolink import TargetReachError
+import os
+import threading
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from robodk.robolink import COLLISION_OFF, COLLISION_ON, ITEM_TYPE_ROBOT, Robolink, TargetReachError
+from robodk.robomath import Mat
 
-RDK = robolink.Robolink()
+RDK = Robolink()
 
 INSTRUCTION_INSERT_CODE = 0
 
-# Global speed and acceleration settings
-GLOBAL_SPEED = 600           # Default speed in mm/s
-GLOBAL_ACCELERATION = 500     # Default acceleration in mm/s^2
+# Speed (mm/s) and acceleration (mm/s^2) for each motion phase, taken from the
+# original program: 1000 mm/s, except 200 mm/s for the setSpeed(200) moves.
+# These are not measured limits and no margin is applied. Each move uses the
+# phase that gives its original speed; the pedestal drop is the only exception
+# (see move_endcap_to_pedestal). Raise a phase only after testing it on the cell.
+PHASE_SPEEDS = {
+    "transit": (1000, 500),     # Empty gripper, including the descent onto a tray part
+    "carrying": (1000, 500),    # Part in the gripper
+    "precise": (200, 500),      # Tray release, and down into and back out of the clamp
+}
 
 # Tray slot positions (XY in mm)
 tray_coords = {
-    0: [-414.4, -456.17],    # Endcap (robot 2: [-483.39, -462.03])
-    1: [-334.85, -456.72],  # Battery (robot 2: [-402.396, -459.981])
-    2: [-259.08, -457.45],  # Head (robot 2: [-326.785, -459.887])
-    3: [-182.53, -456.90],     # Pedestal (robot 2: [-251.57, -460.99])
+    0: [-414.4, -456.17],    # Endcap
+    1: [-334.85, -456.72],  # Battery
+    2: [-259.08, -457.45],  # Head
+    3: [-182.53, -456.90],     # Pedestal
     4: [-256.8, -458.1]   # Release finished flashlight into tray
 }
 
-CLEAR_HEIGHT = 130            # Approach (clear) height (mm)
+# Tray heights (mm): the empty gripper approaches TRAY_APPROACH_MARGIN above the
+# grip height of the part it is about to pick (never higher than the loaded
+# clear height), while a part in the gripper has to clear the parts in the
+# other slots. Check the approaches with: python flashlight_assembly.py --check-moves
+TRAY_APPROACH_MARGIN = 50
+TRAY_CLEAR_LOADED = 130
 HOME_POSITION = [0, -90, 0, -90, 0, 0]        # Home position in joint degrees
 TEST_POSITION = [90, -90, 90, 270, -90, -270]   # Closer-to-table position in joint degrees
 
 # Grip heights for each component (in mm)
-GRIP_HEIGHTS = {
-    "endcap": 10, # Robot 2:
-    "battery": 34, # Robot 2: 24.708
-    "head": 65.3, # Robot 2: 52.95
-    "pedestal": 60.9 # Robot 2:
-}
+GripHeights = namedtuple("GripHeights", "endcap battery head pedestal flashlight")
+GRIP_HEIGHTS = GripHeights(
+    endcap=10,
+    battery=34,
+    head=65.3,
+    pedestal=60.9,
+    flashlight=89.90    # Release height for the finished flashlight (tray slot 4)
+)
 
 # Clamp positions
-CLAMP_XY = [-322.98, 38.3] # Robot 2: [-330.53, 34.77]
-CLAMP_HEIGHTS = {
-    "release_head": 163.9, # Robot 2: 151.33
-    "release_battery": 192.751,
-    "release_endcap": 197.31, # Robot 2: 189
-    "pickup_flashlight": 187,
-    "clear": 250
-}
+CLAMP_XY = [-322.98, 38.3]
+ClampHeights = namedtuple("ClampHeights", "release_head release_battery release_endcap pickup_flashlight clear")
+CLAMP_HEIGHTS = ClampHeights(
+    release_head=163.9,
+    release_battery=192.751,
+    release_endcap=197.31,
+    pickup_flashlight=185,  # Recorded as 187, but the cell has always picked up at 185
+    clear=250
+)
 
 # Joint targets for endcap-to-pedestal motion (all values in degrees)
-ENDCAP_CLR_JOINTS   = [37.41, -72.76, 83.21, -100.44, -89.73, -142.51]           # Robot 2: [34.17, -65.64, 73.24, -97.56, -89.73, -145.75]
+ENDCAP_CLR_JOINTS   = [37.41, -72.76, 83.21, -100.44, -89.73, -142.51]
 INTERMEDIATE_JOINTS = [8.348806, -77.787199, 103.336014, -25.548815, 8.348806, -194.849375]
-PED_CLR_JOINTS      = [15.32, -96.4, 143.41, -47.02, 15.3, -180]             # Robot 2: [12.62, -87.67, 134.47, -46.81, 12.61, -179.99]
-PED_DROP_JOINTS     = [15.31, -84.25, 147.34, -63.09, 15.3, -180]          # Robot 2: [12.61, -78.15, 137.70, -59.41, 12.65, -180.15]
-
-# Global clamp parameters
-GRIP_WAIT_TIME = 2.0           # Seconds to wait after gripper operations
-CLAMP_APPROACH_SPEED = 200     # Speed in mm/s when approaching the clamp
-CLAMP_OPERATION_SPEED = 100    # Speed in mm/s during clamp operation
+PED_CLR_JOINTS      = [15.32, -96.4, 143.41, -47.02, 15.3, -180]
+PED_DROP_JOINTS     = [15.31, -84.25, 147.34, -63.09, 15.3, -180]
+
+# Via points between Endcap CLR and Pedestal CLR that keep the move clear of
+# the cell: an empty list if the direct joint move is collision-free, None if
+# the move has not been checked. Re-bake with: python flashlight_assembly.py --find-via
+# which bisects towards VIA_CLEAR_JOINTS, a joint target known to be clear.
+ENDCAP_TO_PED_VIA = [INTERMEDIATE_JOINTS]
+VIA_CLEAR_JOINTS = INTERMEDIATE_JOINTS
+
+# Cap tightening: clamp XY and the two turning angles (only joint 6 changes):
+# "Initial" (0° target) and "Final" (~180° target, goes down by 2.5 mm)
+TIGHTEN_CLAMP_XY       = [-322.25, 38.78]
+INITIAL_TURNING_JOINTS = [-26.51, -115.18, 112.67, -87.48, -90, -206.51]
+FINAL_TURNING_JOINTS   = [-26.510124, -115.194661, 113.040864, -87.836005, -89.999890, 11.929876]
+
+# Robot 2 runs its own copy of the cell. Values without a robot 2
+# calibration yet are None; main() will not run the cell until
+# missing_calibration() finds none left.
+ROBOT2_TRAY_COORDS = {
+    0: [-483.39, -462.03],
+    1: [-402.396, -459.981],
+    2: [-326.785, -459.887],
+    3: [-251.57, -460.99],
+    4: None
+}
+ROBOT2_GRIP_HEIGHTS = GripHeights(
+    endcap=None,
+    battery=24.708,
+    head=52.95,
+    pedestal=None,
+    flashlight=None
+)
+ROBOT2_CLAMP_XY = [-330.53, 34.77]
+ROBOT2_CLAMP_HEIGHTS = ClampHeights(
+    release_head=151.33,
+    release_battery=None,
+    release_endcap=189,
+    pickup_flashlight=None,
+    clear=None
+)
+ROBOT2_ENDCAP_CLR_JOINTS = [34.17, -65.64, 73.24, -97.56, -89.73, -145.75]
+ROBOT2_PED_CLR_JOINTS    = [12.62, -87.67, 134.47, -46.81, 12.61, -179.99]
+ROBOT2_PED_DROP_JOINTS   = [12.61, -78.15, 137.70, -59.41, 12.65, -180.15]
+ROBOT2_ENDCAP_TO_PED_VIA = None
+ROBOT2_VIA_CLEAR_JOINTS  = None
+ROBOT2_TIGHTEN_CLAMP_XY       = [-330.9, 35.86]
+ROBOT2_INITIAL_TURNING_JOINTS = [-25.27, -114.01, 113.04, -89.01, -89.94, -205.07]
+ROBOT2_FINAL_TURNING_JOINTS   = [-25.27, -114.01, 113.27, -89.23, -89.94, -31.58]
+
+# Per-robot cell layout
+Cell = namedtuple("Cell", [
+    "name",                     # Robot name in the station
+    "tray_coords",
+    "grip_heights",
+    "clamp_xy",
+    "clamp_heights",
+    "endcap_clr_joints",
+    "endcap_to_ped_via",
+    "via_clear_joints",
+    "ped_clr_joints",
+    "ped_drop_joints",
+    "tighten_clamp_xy",
+    "initial_turning_joints",
+    "final_turning_joints",
+])
+ROBOT1_CELL = Cell(
+    name="UR5",
+    tray_coords=tray_coords,
+    grip_heights=GRIP_HEIGHTS,
+    clamp_xy=CLAMP_XY,
+    clamp_heights=CLAMP_HEIGHTS,
+    endcap_clr_joints=ENDCAP_CLR_JOINTS,
+    endcap_to_ped_via=ENDCAP_TO_PED_VIA,
+    via_clear_joints=VIA_CLEAR_JOINTS,
+    ped_clr_joints=PED_CLR_JOINTS,
+    ped_drop_joints=PED_DROP_JOINTS,
+    tighten_clamp_xy=TIGHTEN_CLAMP_XY,
+    initial_turning_joints=INITIAL_TURNING_JOINTS,
+    final_turning_joints=FINAL_TURNING_JOINTS,
+)
+ROBOT2_CELL = Cell(
+    name="UR5_2",
+    tray_coords=ROBOT2_TRAY_COORDS,
+    grip_heights=ROBOT2_GRIP_HEIGHTS,
+    clamp_xy=ROBOT2_CLAMP_XY,
+    clamp_heights=ROBOT2_CLAMP_HEIGHTS,
+    endcap_clr_joints=ROBOT2_ENDCAP_CLR_JOINTS,
+    endcap_to_ped_via=ROBOT2_ENDCAP_TO_PED_VIA,
+    via_clear_joints=ROBOT2_VIA_CLEAR_JOINTS,
+    ped_clr_joints=ROBOT2_PED_CLR_JOINTS,
+    ped_drop_joints=ROBOT2_PED_DROP_JOINTS,
+    tighten_clamp_xy=ROBOT2_TIGHTEN_CLAMP_XY,
+    initial_turning_joints=ROBOT2_INITIAL_TURNING_JOINTS,
+    final_turning_joints=ROBOT2_FINAL_TURNING_JOINTS,
+)
+CELLS = {cell.name: cell for cell in (ROBOT1_CELL, ROBOT2_CELL)}
+
+def missing_calibration(cell):
+    """Returns the names of the cell's layout values that are still None."""
+    missing = ["tray_coords[%d]" % slot for slot, xy in cell.tray_coords.items() if xy is None]
+    for field in ("grip_heights", "clamp_heights"):
+        values = getattr(cell, field)._asdict()
+        missing += ["%s.%s" % (field, name) for name, value in values.items() if value is None]
+    # via_clear_joints is only needed by --find-via, and only if the direct
+    # move collides
+    missing += [field for field, value in cell._asdict().items()
+                if value is None and field != "via_clear_joints"]
+    return missing
+
+# Gripper close: returns as soon as the gripper reports its motion finished
+# (object gripped or fully closed), polling the status every GRIP_POLL_TIME
+GRIP_POLL_TIME = 0.01          # Seconds between gripper status checks
+GRIP_CLOSE_CODE = "\n".join([
+    "rq_close()",
+    "sleep(%.2f)" % GRIP_POLL_TIME,
+    "while not rq_is_motion_complete():",
+    "  sleep(%.2f)" % GRIP_POLL_TIME,
+    "end",
+])
+
+# Gripper open: waits the same way until the fingers have stopped, so the arm
+# does not pull the part away before it is released
+GRIP_OPEN_CODE = GRIP_CLOSE_CODE.replace("rq_close()", "rq_open()")
+
+# Cap tightening oscillation (joint speeds in deg/s). No joint acceleration is
+# set for the turns, so they keep the controller's default as before.
+TURN_CYCLES = 6
+TURN_FIRST_SPEED = 700         # Joint speed for the first turn
+TURN_SPEED = 200               # Joint speed for the remaining moves
+
+# Blend radius (mm) for approach waypoints the robot only passes through.
+# Waypoints where the gripper opens or closes are always exact stops.
+BLEND_RADIUS = 10
+
+# Pedestal drop: the last PED_SLOW_DISTANCE (mm) down to the drop point run at
+# the "precise" phase speed
+PED_SLOW_DISTANCE = 10
+
+# Rotation part of Pose(0, 0, 0, 180, 0, 90): the gripper-down orientation
+# shared by every tray and clamp target
+DOWN_ROTATION = [
+    [0, -1, 0],
+    [-1, 0, 0],
+    [0, 0, -1],
+]
+
+# Cartesian poses keyed by (x, y, z), filled in by cached_pose()
+POSE_CACHE = {}
+
+# Joint solutions (degrees) keyed by "v<version>:robot:<setup>:<seed>:x,y,z", saved
+# next to this script so later runs skip the IK solve. <setup> is a hash of the
+# active tool and frame poses and <seed> a hash of the seed joints, so entries for
+# another tool, frame or seed are never used. Bump IK_CACHE_VERSION whenever the way
+# solutions are picked changes; entries from other versions are dropped on load.
+IK_CACHE_VERSION = 3
+IK_CACHE_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "ik_cache.json")
+IK_CACHE = {}
 
 # ------------------------------------------------------------------
 # Helper Functions
 # ------------------------------------------------------------------
+def robot_state(robot):
+    """
+    Returns the dict kept on the robot item (or on the ScriptBuilder or
+    MoveRecorder standing in for it) with the speed, acceleration and
+    rounding last sent to it and the hash of its tool and frame. A new item
+    or wrapper starts empty.
+    """
+    return vars(robot).setdefault("assembly_state", {})
+
 def set_motion_params(speed, acceleration, robot):
-    """Sets the robot's speed and acceleration to the global settings."""
-    robot.setSpeed(speed)
-    robot.setAcceleration(acceleration)
+    """Sets the robot's speed and acceleration, skipping values already applied."""
+    set_speed(speed, robot)
+    applied = robot_state(robot)
+    if applied.get("acceleration") != acceleration:
+        robot.setAcceleration(acceleration)
+        applied["acceleration"] = acceleration
+
+def set_phase(phase, robot):
+    """Sets the robot's speed and acceleration for a motion phase in PHASE_SPEEDS."""
+    speed, acceleration = PHASE_SPEEDS[phase]
+    set_motion_params(speed, acceleration, robot)
+
+def set_speed(speed, robot):
+    """Sets the robot's linear speed unless it is already set to that value."""
+    applied = robot_state(robot)
+    if applied.get("speed") != speed:
+        robot.setSpeed(speed)
+        applied["speed"] = speed
+
+def set_rounding(radius, robot):
+    """Sets the robot's blend radius (mm) unless it is already set to that value."""
+    applied = robot_state(robot)
+    if applied.get("rounding") != radius:
+        robot.setRounding(radius)
+        applied["rounding"] = radius
+
+def cached_pose(x, y, z):
+    """
+    Returns the Cartesian Pose at (x, y, z) with orientation [180, 0, 90]
+    (in degrees). Every target in the cell shares that orientation, so the
+    pose is assembled from DOWN_ROTATION without any trig, built once and
+    reused from POSE_CACHE afterwards.
+    """
+    key = (x, y, z)
+    pose = POSE_CACHE.get(key)
+    if pose is None:
+        rows = [row + [t] for row, t in zip(DOWN_ROTATION, (x, y, z))]
+        pose = POSE_CACHE[key] = Mat(rows + [[0, 0, 0, 1]])
+    return pose
+
+def pose_joints(x, y, z, seed, cell, robot):
+    """
+    Returns the joints (degrees) that reach cached_pose(x, y, z) with the
+    robot's active tool and frame. IK is solved once, picking the solution
+    closest to the seed joints, and the result is kept in IK_CACHE.
+    """
+    key = "v%d:%s:%s:%s:%.3f,%.3f,%.3f" % (IK_CACHE_VERSION, cell.name, ik_setup(robot), short_hash(seed), x, y, z)
+    joints = IK_CACHE.get(key)
+    if joints is None:
+        solutions = robot.SolveIK_All(cached_pose(x, y, z), robot.PoseTool(), robot.PoseFrame())
+        joints = closest_solution(solutions, seed)
+        if joints is None:
+            raise TargetReachError("No IK solution for target at " + key)
+        IK_CACHE[key] = joints
+    return joints
+
+def ik_setup(robot):
+    """
+    Returns a short hash of the robot's active tool and frame poses. The
+    poses are read from RoboDK once per robot item.
+    """
+    state = robot_state(robot)
+    if "ik_setup" not in state:
+        poses = (robot.PoseTool(), robot.PoseFrame())
+        state["ik_setup"] = short_hash([v for pose in poses for row in pose.rows for v in row])
+    return state["ik_setup"]
+
+def short_hash(values):
+    """Returns a short hash of a list of numbers, rounded to 4 decimals."""
+    text = ",".join("%.4f" % v for v in values)
+    return hashlib.sha1(text.encode()).hexdigest()[:12]
+
+def closest_solution(solutions, reference):
+    """
+    Returns the IK solution (first six joints of each column of a
+    SolveIK_All result) whose largest single-joint move from the reference
+    joints is smallest, or None if there are no solutions. This avoids
+    solutions that need a wrist flip or a large joint 6 wrap.
+    """
+    if not solutions.rows or not solutions.rows[0]:
+        return None
+    candidates = [q[:6] for q in solutions.tr().rows]
+    return min(candidates, key=lambda q: max(abs(a - b) for a, b in zip(q, reference)))
 
-def tray_pose(tray_index, z):
+def tray_joints(tray_index, z, cell, robot):
     """
-    Returns a standard Cartesian Pose for a given tray slot and Z height,
-    using orientation [180, 0, 90] (in degrees).
+    Returns the joints for a given tray slot and Z height, seeded with the
+    gripper-down configuration at Endcap CLR.
     """
-    x, y = tray_coords[tray_index]
-    return Pose(x, y, z, 180, 0, 90)
+    x, y = cell.tray_coords[tray_index]
+    return pose_joints(x, y, z, cell.endcap_clr_joints, cell, robot)
+
+def tray_approach_height(grip_height):
+    """Returns the empty-gripper approach height over a part gripped at grip_height."""
+    return min(grip_height + TRAY_APPROACH_MARGIN, TRAY_CLEAR_LOADED)
+
+def clamp_joints(z, cell, robot):
+    """
+    Returns the joints above the clamp at a given Z height, seeded with the
+    initial turning angle.
+    """
+    x, y = cell.clamp_xy
+    return pose_joints(x, y, z, cell.initial_turning_joints, cell, robot)
+
+def load_ik_cache():
+    """
+    Loads previously solved joints from IK_CACHE_FILE, if it exists, keeping
+    only the entries of the current IK_CACHE_VERSION.
+    """
+    if os.path.exists(IK_CACHE_FILE):
+        with open(IK_CACHE_FILE) as f:
+            prefix = "v%d:" % IK_CACHE_VERSION
+            IK_CACHE.update((key, joints) for key, joints in json.load(f).items() if key.startswith(prefix))
+
+def save_ik_cache():
+    """Writes the solved joints to IK_CACHE_FILE."""
+    with open(IK_CACHE_FILE, "w") as f:
+        json.dump(IK_CACHE, f, indent=1, sort_keys=True)
+
+def urscript_joints(joints):
+    """Formats a joint target given in degrees as a URScript joint list (radians)."""
+    return "[" + ", ".join("%.6f" % math.radians(j) for j in joints) + "]"
+
+def urscript_movel(target, phase, radius=0):
+    """
+    Formats a URScript movel to a target expression at the speed and
+    acceleration of a motion phase in PHASE_SPEEDS, with a blend radius in mm.
+    """
+    speed, accel = PHASE_SPEEDS[phase]
+    return "movel(%s, a=%.3f, v=%.3f, r=%.4f)" % (target, accel / 1000, speed / 1000, radius / 1000)
+
+class ScriptBuilder:
+    """
+    Stands in for a RoboDK robot item and collects the motion and custom code
+    the helpers send as URScript lines instead of individual API calls, so
+    the whole program can be sent with one RunCodeCustom. Speeds, accelerations
+    and the blend radius become URScript variables, starting at the URScript
+    defaults. Move targets must be joint lists (degrees). Anything else, such
+    as SolveIK, is passed through to the wrapped robot.
+    """
+    def __init__(self, robot):
+        self.robot = robot
+        self.lines = [
+            "asm_v = 0.25",     # Linear speed (m/s)
+            "asm_a = 1.2",      # Linear acceleration (m/s^2)
+            "asm_vj = 1.05",    # Joint speed (rad/s)
+            "asm_aj = 1.4",     # Joint acceleration (rad/s^2)
+            "asm_r = 0",        # Blend radius (m)
+        ]
+
+    def __getattr__(self, name):
+        return getattr(self.robot, name)
+
+    def setSpeed(self, speed):
+        self.lines.append("asm_v = %.4f" % (speed / 1000))
+
+    def setAcceleration(self, acceleration):
+        self.lines.append("asm_a = %.4f" % (acceleration / 1000))
+
+    def setSpeedJoints(self, speed):
+        self.lines.append("asm_vj = %.6f" % math.radians(speed))
+
+    def setRounding(self, radius):
+        self.lines.append("asm_r = %.4f" % (max(radius, 0) / 1000))
+
+    def MoveJ(self, joints):
+        self.lines.append("movej(%s, a=asm_aj, v=asm_vj, r=asm_r)" % urscript_joints(joints))
+
+    def MoveL(self, joints):
+        self.lines.append("movel(%s, a=asm_a, v=asm_v, r=asm_r)" % urscript_joints(joints))
+
+    def RunCodeCustom(self, code, run_type=INSTRUCTION_INSERT_CODE):
+        self.lines.append(code)
+
+    def setJoints(self, joints):
+        # Nothing has moved yet while the program is being built
+        pass
+
+    def finalize(self):
+        """Returns the collected program as one URScript string."""
+        return "\n".join(self.lines)
 
 # ------------------------------------------------------------------
 # Core Functions
 # ------------------------------------------------------------------
-def goto_and_pickup_tray(tray_slot_index, pickup_height, clear_height, robot):
+def goto_and_pickup_tray(tray_slot_index, pickup_height, approach_height, retract_height, cell, robot):
     """
     Moves the robot to a tray slot:
-      - Approaches at the clear height.
+      - Approaches at the approach height (empty gripper).
       - Lowers to the pickup height.
       - Closes the gripper.
-      - Raises back to the clear height.
+      - Raises to the retract height (part in the gripper).
     
-    For tray slot 0 (endcap), uses the preferred joint target.
+    For tray slot 0 (endcap), approaches via the preferred joint target
+    instead, so approach_height is not used.
     """
-    set_motion_params(1000, GLOBAL_ACCELERATION, robot)
+    set_phase("transit", robot)
     
+    set_rounding(BLEND_RADIUS, robot)
     if tray_slot_index == 0:
-        robot.MoveJ(ENDCAP_CLR_JOINTS)
-        robot.MoveL(Pose(tray_coords[0][0], tray_coords[0][1], pickup_height, 180, 0, 90))
-        robot.RunCodeCustom('rq_close_and_wait()', INSTRUCTION_INSERT_CODE)
-        robot.MoveL(Pose(tray_coords[0][0], tray_coords[0][1], clear_height, 180, 0, 90))
+        robot.MoveJ(cell.endcap_clr_joints)
+        set_rounding(0, robot)
+        robot.MoveL(tray_joints(0, pickup_height, cell, robot))
+        robot.RunCodeCustom(GRIP_CLOSE_CODE, INSTRUCTION_INSERT_CODE)
+        set_phase("carrying", robot)
+        robot.MoveL(tray_joints(0, retract_height, cell, robot))
     else:
-        approach = tray_pose(tray_slot_index, clear_height)
-        pickup   = tray_pose(tray_slot_index, pickup_height)
+        approach = tray_joints(tray_slot_index, approach_height, cell, robot)
+        pickup   = tray_joints(tray_slot_index, pickup_height, cell, robot)
+        retract  = tray_joints(tray_slot_index, retract_height, cell, robot)
         robot.MoveJ(approach)
+        set_rounding(0, robot)
         robot.MoveL(pickup)
-        robot.RunCodeCustom('rq_close_and_wait()', INSTRUCTION_INSERT_CODE)
-        robot.MoveL(approach)
+        robot.RunCodeCustom(GRIP_CLOSE_CODE, INSTRUCTION_INSERT_CODE)
+        set_phase("carrying", robot)
+        robot.MoveL(retract)
 
-def goto_and_release_tray(tray_slot_index, release_height, clear_height, robot):
+def goto_and_release_tray(tray_slot_index, release_height, approach_height, retract_height, cell, robot):
     """
     Moves the robot to a tray slot:
-      - Approaches at the clear height.
+      - Approaches at the approach height (part in the gripper).
       - Lowers to the release height.
       - Opens the gripper.
-      - Raises back to the clear height.
+      - Raises to the retract height (empty gripper), which must be above
+        the released part.
     """
-    approach = tray_pose(tray_slot_index, clear_height)
-    release  = tray_pose(tray_slot_index, release_height)
-    set_motion_params(1000, GLOBAL_ACCELERATION, robot)
+    approach = tray_joints(tray_slot_index, approach_height, cell, robot)
+    release  = tray_joints(tray_slot_index, release_height, cell, robot)
+    retract  = tray_joints(tray_slot_index, retract_height, cell, robot)
+    set_phase("carrying", robot)
+    set_rounding(BLEND_RADIUS, robot)
     robot.MoveL(approach)
-    robot.setSpeed(200)
+    set_phase("precise", robot)
+    set_rounding(0, robot)
     robot.MoveL(release)
-    robot.RunCodeCustom('rq_open()', INSTRUCTION_INSERT_CODE)
-    robot.MoveL(approach)
+    robot.RunCodeCustom(GRIP_OPEN_CODE, INSTRUCTION_INSERT_CODE)
+    robot.MoveL(retract)
 
-def move_endcap_to_pedestal(robot):
+def move_endcap_to_pedestal(cell, robot):
     """
     Moves the endcap (already grasped at Endcap CLR) to the pedestal by:
-      1. Moving via an intermediate joint target.
+      1. Moving via the cell's intermediate joint targets, if it needs any.
       2. Moving to the Pedestal clear height (joint move for orientation).
-      3. Lowering linearly (MoveL) from Pedestal clear height to the pedestal grip height.
+      3. Lowering linearly from Pedestal clear height to the pedestal grip height,
+         slowing down for the last PED_SLOW_DISTANCE.
       4. Releasing the gripper.
       5. Raising linearly back to Pedestal clear height.
+
+    Steps 3-5 are sent as one URScript block so the arm blends through the
+    slow-down waypoint and only stops at the drop point. Unlike the original
+    program, the last PED_SLOW_DISTANCE down runs at the precise speed instead
+    of 1000 mm/s, and the retract is a linear move at the precise speed
+    instead of a joint move.
     """
-    set_motion_params(1000, GLOBAL_ACCELERATION, robot)
-    robot.MoveJ(INTERMEDIATE_JOINTS)
-    robot.MoveJ(PED_CLR_JOINTS)
-    robot.MoveL(PED_DROP_JOINTS)
-    robot.RunCodeCustom('rq_open()', INSTRUCTION_INSERT_CODE)
-    robot.MoveJ(PED_CLR_JOINTS)
+    set_phase("carrying", robot)
+    set_rounding(BLEND_RADIUS, robot)
+    for via in cell.endcap_to_ped_via:
+        robot.MoveJ(via)
+    robot.MoveJ(cell.ped_clr_joints)
+
+    drop = urscript_joints(cell.ped_drop_joints)
+    clear = urscript_joints(cell.ped_clr_joints)
+    slow_down = "pose_add(get_forward_kin(%s), p[0, 0, %.4f, 0, 0, 0])" % (drop, PED_SLOW_DISTANCE / 1000)
+    drop_script = "\n".join([
+        urscript_movel(slow_down, "carrying", PED_SLOW_DISTANCE / 2),
+        urscript_movel(drop, "precise"),
+        GRIP_OPEN_CODE,
+        urscript_movel(clear, "precise"),
+    ])
+    robot.RunCodeCustom(drop_script, INSTRUCTION_INSERT_CODE)
 
 # ------------------------------------------------------------------
 # Integrated Clamp Functions
 # ------------------------------------------------------------------
-def pickup_from_clamp(pickup_height, clear_height, robot):
+def pickup_from_clamp(pickup_height, clear_height, cell, robot):
     """
     Picks up an item from the clamp:
-      - Approaches the clamp at clear height.
       - Lowers to pickup height.
       - Closes the gripper to grasp the item.
       - Raises back to the clear height.
-    """
-    set_motion_params(1000, GLOBAL_ACCELERATION, robot)
-    safe_pose = Pose(CLAMP_XY[0], CLAMP_XY[1], clear_height, 180, 0, 90)
-    pickup_pose = Pose(CLAMP_XY[0], CLAMP_XY[1], pickup_height, 180, 0, 90)
-    robot.setSpeed(200)
-    robot.MoveL(pickup_pose)
-    robot.RunCodeCustom('rq_close_and_wait()', INSTRUCTION_INSERT_CODE)
-    robot.MoveL(safe_pose)
 
-def release_into_clamp(release_height, clear_height, robot):
+    The moves are sent as one URScript block. RoboDK does not follow custom
+    code, so its robot is then placed at the clear height.
+    """
+    safe_pose = clamp_joints(clear_height, cell, robot)
+    pickup_pose = clamp_joints(pickup_height, cell, robot)
+    pickup_script = "\n".join([
+        urscript_movel(urscript_joints(pickup_pose), "precise"),
+        GRIP_CLOSE_CODE,
+        urscript_movel(urscript_joints(safe_pose), "precise"),
+    ])
+    robot.RunCodeCustom(pickup_script, INSTRUCTION_INSERT_CODE)
+    robot.setJoints(safe_pose)
+
+def release_into_clamp(release_height, clear_height, cell, robot):
     """
     Releases an item into the clamp:
       - Approaches the clamp at clear height.
       - Lowers to release height.
       - Opens the gripper to release the item.
       - Raises back to the clear height.
+
+    The approach is a blended RoboDK move. The descent, release and retract
+    are sent as one URScript block that ends back at the clear height, where
+    RoboDK's robot already is.
     """
-    set_motion_params(1000, GLOBAL_ACCELERATION, robot)
-    safe_pose = Pose(CLAMP_XY[0], CLAMP_XY[1], clear_height, 180, 0, 90)
-    release_pose = Pose(CLAMP_XY[0], CLAMP_XY[1], release_height, 180, 0, 90)
+    safe_pose = clamp_joints(clear_height, cell, robot)
+    release_pose = clamp_joints(release_height, cell, robot)
+    set_phase("carrying", robot)
+    set_rounding(BLEND_RADIUS, robot)
     robot.MoveJ(safe_pose)
-    robot.setSpeed(200)
-    robot.MoveL(release_pose)
-    robot.RunCodeCustom('rq_open()', INSTRUCTION_INSERT_CODE)
-    robot.MoveL(safe_pose)
+
+    release_script = "\n".join([
+        urscript_movel(urscript_joints(release_pose), "precise"),
+        GRIP_OPEN_CODE,
+        urscript_movel(urscript_joints(safe_pose), "precise"),
+    ])
+    robot.RunCodeCustom(release_script, INSTRUCTION_INSERT_CODE)
 
 
 
 
-def tighten_cap(robot):
+def tighten_cap(cell, robot):
 
-    set_motion_params(1000, GLOBAL_ACCELERATION, robot)
-    # Define clamp coordinates and heights (from global variables)
-    new_clamp_x = -322.25 # Robot 2: -330.9
-    new_clamp_y = 38.78 # Robot 2: 35.86
-    safe_pose = Pose(new_clamp_x, new_clamp_y, CLAMP_HEIGHTS["clear"], 180, 0, 90)
-    # release_pose = Pose(new_clamp_x, new_clamp_y, CLAMP_HEIGHTS["release_endcap"], 180, 0, 90)
+    set_phase("carrying", robot)
+    # Define clamp coordinates and heights (from the cell layout)
+    new_clamp_x, new_clamp_y = cell.tighten_clamp_xy
+    initial_turning_angle = cell.initial_turning_joints
+    safe_pose = pose_joints(new_clamp_x, new_clamp_y, cell.clamp_heights.clear, initial_turning_angle, cell, robot)
+    # release_pose = Pose(new_clamp_x, new_clamp_y, CLAMP_HEIGHTS.release_endcap, 180, 0, 90)
     
-    # Base turning angles (only joint 6 changes):
-    # "Initial" (0° target) and "Final" (~180° target)
     # anti_30 = [-26.509508, -115.182409, 112.727496, -87.535252, -90.000530, -249.119509] # Move anticlockwise 30 degrees while applying "0.3-mm" downward pressure
-    initial_turning_angle = [-26.51, -115.18, 112.67, -87.48, -90, -206.51] # Robot 2: [-25.27, -114.01, 113.04, -89.01, -89.94, -205.07]
-    final_turning_angle   = [-26.510124, -115.194661, 113.040864, -87.836005, -89.999890, 11.929876] # Robot 2: [-25.27, -114.01, 113.27, -89.23, -89.94, -31.58]
-    # final_turning_angle goes down by 2.5 mm
     
     # Engage the clamp.
     robot.RunCodeCustom('clamp()', INSTRUCTION_INSERT_CODE)
     
     # Move to the safe approach pose and then lower to the release pose.
+    set_rounding(BLEND_RADIUS, robot)
     robot.MoveJ(safe_pose)
+    set_rounding(0, robot)
     robot.MoveL(initial_turning_angle)
 
     # Turn 30 degrees anticlockwise
     # robot.MoveJ(anti_30)
     # robot.RunCodeCustom('rq_open()', INSTRUCTION_INSERT_CODE)
 
-    robot.setSpeedJoints(700)
+    # Oscillate, torque-tighten and unclamp with the function installed by
+    # install_tighten_cap().
+    robot.RunCodeCustom('tighten_cap_full()', INSTRUCTION_INSERT_CODE)
+    robot.setSpeedJoints(TURN_SPEED)
 
-    # Toggle between the two turning angles for a number of cycles.
-    for i in range(6):
-        robot.RunCodeCustom('rq_close_and_wait()', INSTRUCTION_INSERT_CODE)
-        robot.MoveJ(final_turning_angle)
-        robot.RunCodeCustom('rq_open()', INSTRUCTION_INSERT_CODE)
-        robot.setSpeedJoints(200)
-        robot.MoveJ(initial_turning_angle)
+def install_tighten_cap(cell, robot):
+    """
+    Defines the URScript function tighten_cap_full() at the start of the
+    program, with the cell's turning angles baked in as URScript constants.
+    It runs on the controller from the initial turning angle:
+      - Toggles between the initial and final turning angles, closing the
+        gripper before each turn and opening it before turning back.
+      - Torque-tightens the cap.
+      - Unclamps.
+    """
+    definition = "\n".join([
+        "global tighten_initial = %s" % urscript_joints(cell.initial_turning_joints),
+        "global tighten_final = %s" % urscript_joints(cell.final_turning_joints),
+        "def tighten_cap_full():",
+        "  turn_v = %.6f" % math.radians(TURN_FIRST_SPEED),
+        "  turn_i = 0",
+        "  while turn_i < %d:" % TURN_CYCLES,
+        "    " + GRIP_CLOSE_CODE.replace("\n", "\n    "),
+        "    movej(tighten_final, v=turn_v)",
+        "    rq_open()",
+        "    turn_v = %.6f" % math.radians(TURN_SPEED),
+        "    movej(tighten_initial, v=turn_v)",
+        "    turn_i = turn_i + 1",
+        "  end",
+        # Final torque-based tightening (from the initial turning angle) followed by unclamping.
+        # tighten_torque(torqueLimit, startAngle, endAngle, jointAccel, jointSpeed, num_checkTorque, gripperForce, gripperSpeed, gripperOpen)
+        "  movej(tighten_initial, v=turn_v)",
+        "  tighten_torque(2, -205.27, -115.27, 2, 2, 1, 100, 100, 50)",   # 2, -90, 51.56, 2, 2, 1, 100, 100, 50
+        "  unclamp()",
+        "end",
+    ])
+    robot.RunCodeCustom(definition, INSTRUCTION_INSERT_CODE)
 
-    # Final torque-based tightening followed by unclamping.
-    #tighten_torque_pose = [-26.509597, -115.227184, 114.226946, -88.989923, -90.000438, -206.509597]
-    tighten_torque_pose = [-26.51, -115.18, 112.67, -87.48, -90, -206.51]
-    robot.MoveJ(tighten_torque_pose)
 
-    #tighten_torque(torqueLimit, startAngle, endAngle, jointAccel, jointSpeed,num_checkTorque, gripperForce, gripperSpeed, gripperOpen)
-    robot.RunCodeCustom('tighten_torque(2, -205.27, -115.27, 2, 2, 1, 100, 100, 50)', INSTRUCTION_INSERT_CODE) #2, -90, 51.56, 2, 2, 1, 100, 100, 50
-    robot.RunCodeCustom('unclamp()', INSTRUCTION_INSERT_CODE)
 
 
 
@@ -222,43 +632,349 @@ def tighten_cap(robot):
 
 
 
+# ------------------------------------------------------------------
+# Assembly Tasks
+# ------------------------------------------------------------------
+def endcap_to_pedestal(cell, robot):
+    """Moves the endcap from its tray slot onto the pedestal."""
+    grip = cell.grip_heights.endcap
+    goto_and_pickup_tray(0, grip, tray_approach_height(grip), TRAY_CLEAR_LOADED, cell, robot)
+    move_endcap_to_pedestal(cell, robot)
+
+def head_to_clamp(cell, robot):
+    """Moves the flashlight head into the clamp."""
+    clamp = cell.clamp_heights
+    grip = cell.grip_heights.head
+    goto_and_pickup_tray(2, grip, tray_approach_height(grip), TRAY_CLEAR_LOADED, cell, robot)
+    release_into_clamp(clamp.release_head, clamp.clear, cell, robot)
+
+def battery_to_clamp(cell, robot):
+    """Moves the battery into the flashlight head."""
+    clamp = cell.clamp_heights
+    grip = cell.grip_heights.battery
+    goto_and_pickup_tray(1, grip, tray_approach_height(grip), TRAY_CLEAR_LOADED, cell, robot)
+    release_into_clamp(clamp.release_battery, clamp.clear, cell, robot)
+
+def tighten_endcap(cell, robot):
+    """Moves the endcap from the pedestal to the clamp and tightens it."""
+    grip = cell.grip_heights.pedestal
+    goto_and_pickup_tray(3, grip, tray_approach_height(grip), TRAY_CLEAR_LOADED, cell, robot)
+    tighten_cap(cell, robot)
+
+def return_flashlight(cell, robot):
+    """Moves the assembled flashlight from the clamp back to the tray."""
+    pickup_from_clamp(cell.clamp_heights.pickup_flashlight, cell.clamp_heights.clear, cell, robot)
+    # The empty gripper has to rise clear of the assembled flashlight, so it
+    # retracts at the loaded height too
+    goto_and_release_tray(4, cell.grip_heights.flashlight, TRAY_CLEAR_LOADED, TRAY_CLEAR_LOADED, cell, robot)
+
+# Precedence table: each task's action, the XY it starts and ends at (used to
+# plan the order) and the tasks that must be done first. There are two
+# independent chains, head -> battery and endcap -> pedestal, and both must be
+# done before tighten_endcap. The endcap waits on the pedestal (tray slot 3)
+# until it is tightened.
+# Both cells share this layout, so robot 1's coordinates are used for planning.
+Task = namedtuple("Task", "action start_xy end_xy requires")
+
+ASSEMBLY_TASKS = {
+    "endcap_to_pedestal": Task(endcap_to_pedestal, tray_coords[0], tray_coords[3], ()),
+    "head_to_clamp":      Task(head_to_clamp, tray_coords[2], CLAMP_XY, ()),
+    "battery_to_clamp":   Task(battery_to_clamp, tray_coords[1], CLAMP_XY, ("head_to_clamp",)),
+    "tighten_endcap":     Task(tighten_endcap, tray_coords[3], CLAMP_XY, ("endcap_to_pedestal", "battery_to_clamp")),
+    "return_flashlight":  Task(return_flashlight, CLAMP_XY, tray_coords[4], ("tighten_endcap",)),
+}
 
+HOME_XY = [0, 0]    # Home is straight up above the robot base
+
+def plan_assembly_order(tasks, start_xy):
+    """
+    Orders the tasks so that the travel between the end of one task and the
+    start of the next is as short as possible, while every task still runs
+    after its prerequisites. Dynamic programming over (completed tasks, last
+    task); returns the list of task names.
+    """
+    best = {(frozenset(), None): (0.0, [])}
+    for _ in tasks:
+        layer = {}
+        for (done, last), (cost, order) in best.items():
+            here = tasks[last].end_xy if last else start_xy
+            for name, task in tasks.items():
+                if name in done or not done.issuperset(task.requires):
+                    continue
+                key = (done | {name}, name)
+                travel = cost + math.dist(here, task.start_xy)
+                if key not in layer or travel < layer[key][0]:
+                    layer[key] = (travel, order + [name])
+        best = layer
+    return min(best.values())[1]
 
 # ------------------------------------------------------------------
-# Main Program: Assemble the Flashlight
+# Temporal Plan Graph: one node per (robot, task)
 # ------------------------------------------------------------------
-def main():
-    robot = RDK.Item('UR5')
-    
+def build_plan_graph(robot_names):
+    """
+    Builds the temporal plan graph for the given robots as a dict of
+    node -> prerequisite nodes, in execution order. Each robot runs the
+    planned task order in its own cell, which already satisfies the
+    precedence table; a node may also wait on another robot's node to guard
+    a shared resource. The cells share nothing at the moment, so there are
+    no edges between robots, and with only one calibrated cell (see
+    missing_calibration) there is a single robot. The per-robot threads and
+    finished events in run_plan_graph only come into play once a second
+    cell is calibrated and the cells share something.
+    """
+    order = plan_assembly_order(ASSEMBLY_TASKS, HOME_XY)
+    graph = {}
+    for name in robot_names:
+        previous = []
+        for task in order:
+            graph[(name, task)] = previous
+            previous = [(name, task)]
+    return graph
+
+def run_robot(name, graph, finished, bulk=False):
+    """
+    Runs one robot's nodes of the plan graph with send_tasks() on its own
+    RoboDK connection, with rendering turned off on that connection while
+    the program is sent.
+    """
+    rdk = Robolink()
+    # Skip rendering the station after every instruction; the scene is
+    # redrawn once the program has been sent.
+    rdk.Render(False)
+    try:
+        send_tasks(name, rdk.Item(name, ITEM_TYPE_ROBOT), graph, finished, bulk)
+    finally:
+        rdk.Render(True)
+
+def send_tasks(name, robot, graph, finished, bulk=False):
+    """
+    Sends one robot's nodes of the plan graph in order, waiting for each
+    node's prerequisites to finish first. With bulk set, the whole sequence
+    is collected by a ScriptBuilder and sent as a single URScript
+    instruction at the end.
+    """
+    cell = CELLS[name]
+    if bulk:
+        target = robot
+        robot = ScriptBuilder(target)
+
     # Unclamp at start in case clamp is stuck
     robot.RunCodeCustom('unclamp()', INSTRUCTION_INSERT_CODE)
-    
-    # Step 1: Start from Home
+    install_tighten_cap(cell, robot)
+
+    # Start from Home
     robot.MoveJ(HOME_POSITION)
-    set_motion_params(1000, GLOBAL_ACCELERATION, robot)
+    set_phase("transit", robot)
+
+    for node, requires in graph.items():
+        if node[0] != name:
+            continue
+        for other in requires:
+            finished[other].wait()
+        action = ASSEMBLY_TASKS[node[1]].action
+        action(cell, robot)
+        finished[node].set()
 
-    # Step 2: Move the endcap to the pedestal
-    goto_and_pickup_tray(0, GRIP_HEIGHTS["endcap"], CLEAR_HEIGHT, robot)
-    move_endcap_to_pedestal(robot)
-    
-    # Step 3: Move the flashlight head into the clamp
-    goto_and_pickup_tray(2, GRIP_HEIGHTS["head"], CLEAR_HEIGHT, robot)
-    release_into_clamp(CLAMP_HEIGHTS["release_head"], CLAMP_HEIGHTS["clear"], robot)
-    
-    # Step 4: Move the battery to the flashlight head
-    goto_and_pickup_tray(1, GRIP_HEIGHTS["battery"], CLEAR_HEIGHT, robot)
-    release_into_clamp(CLAMP_HEIGHTS["release_battery"], CLAMP_HEIGHTS["clear"], robot)
-    
-    # Step 5: Move the endcap from the pedestal to the clamp, then tighten it.
-    goto_and_pickup_tray(3, GRIP_HEIGHTS["pedestal"], CLEAR_HEIGHT, robot)
-    tighten_cap(robot)
-    
-    # Step 6: After tightening, move the assembled flashlight back to tray slot 2 (flashlight head)
-    pickup_from_clamp(185, CLAMP_HEIGHTS["clear"], robot)
-    goto_and_release_tray(4, 89.90, CLEAR_HEIGHT, robot)
-    
     # End: Return to Home
     robot.MoveJ(HOME_POSITION)
 
+    if bulk:
+        target.RunCodeCustom(robot.finalize(), INSTRUCTION_INSERT_CODE)
+
+def run_plan_graph(graph, bulk=False):
+    """Runs every robot in the plan graph concurrently, one thread per robot."""
+    finished = {node: threading.Event() for node in graph}
+    robot_names = list(dict.fromkeys(name for name, _ in graph))
+    with ThreadPoolExecutor(max_workers=len(robot_names)) as pool:
+        runs = [pool.submit(run_robot, name, graph, finished, bulk) for name in robot_names]
+        for run in runs:
+            run.result()
+
+# ------------------------------------------------------------------
+# Offline Checks
+# ------------------------------------------------------------------
+def enable_collisions(link):
+    """
+    Turns RoboDK's collision checking on and returns the pairs that were
+    checked before, for restore_collisions().
+    """
+    pairs = link.CollisionActivePairList()
+    link.setCollisionActive(COLLISION_ON)
+    return pairs
+
+def restore_collisions(link, pairs):
+    """Checks exactly the pairs returned by enable_collisions() again."""
+    link.setCollisionActive(COLLISION_OFF)
+    if pairs:
+        items1, items2, ids1, ids2 = zip(*pairs)
+        link.setCollisionActivePairList([COLLISION_ON] * len(pairs), items1, items2, ids1, ids2)
+
+def find_endcap_to_ped_via(cell, robot, tolerance=0.05):
+    """
+    Uses RoboDK's collision checking to find the smallest detour needed for
+    the joint move from Endcap CLR to Pedestal CLR. Returns an empty list if
+    the direct move is collision-free, otherwise a list holding one via point
+    found by bisecting between the midpoint of the direct move and the cell's
+    via_clear_joints, which must give a clear move.
+    """
+    start, end = cell.endcap_clr_joints, cell.ped_clr_joints
+    link = robot.link
+    pairs = enable_collisions(link)
+    try:
+        if robot.MoveJ_Test(start, end) == 0:
+            return []
+        if cell.via_clear_joints is None:
+            raise RuntimeError("%s: the direct move collides and via_clear_joints is not set" % cell.name)
+
+        midpoint = [(a + b) / 2 for a, b in zip(start, end)]
+        def via(t):
+            return [m + t * (d - m) for m, d in zip(midpoint, cell.via_clear_joints)]
+        def clear(t):
+            return robot.MoveJ_Test(start, via(t)) == 0 and robot.MoveJ_Test(via(t), end) == 0
+
+        if not clear(1.0):
+            raise RuntimeError("%s: the move via via_clear_joints collides" % cell.name)
+
+        low, high = 0.0, 1.0
+        while high - low > tolerance:
+            t = (low + high) / 2
+            if clear(t):
+                high = t
+            else:
+                low = t
+        return [[round(j, 6) for j in via(high)]]
+    finally:
+        restore_collisions(link, pairs)
+        robot.setJoints(start)
+
+class MoveRecorder:
+    """
+    Stands in for a RoboDK robot item like ScriptBuilder, but only records
+    each joint and linear move with the joints it starts from, so the
+    offline checks can test the moves the tasks make without running them.
+    setJoints only updates the current joints; custom code (including the
+    moves inside URScript blocks) and motion settings are dropped. Anything
+    else is passed through to the robot.
+    """
+    def __init__(self, robot, joints):
+        self.robot = robot
+        self.joints = joints
+        self.task = None
+        self.moves = []     # (task, "MoveJ" or "MoveL", start joints, end joints)
+
+    def __getattr__(self, name):
+        return getattr(self.robot, name)
+
+    def setSpeed(self, speed):
+        pass
+
+    def setAcceleration(self, acceleration):
+        pass
+
+    def setSpeedJoints(self, speed):
+        pass
+
+    def setRounding(self, radius):
+        pass
+
+    def MoveJ(self, joints):
+        self.moves.append((self.task, "MoveJ", self.joints, joints))
+        self.joints = joints
+
+    def MoveL(self, joints):
+        self.moves.append((self.task, "MoveL", self.joints, joints))
+        self.joints = joints
+
+    def setJoints(self, joints):
+        self.joints = joints
+
+    def RunCodeCustom(self, code, run_type=INSTRUCTION_INSERT_CODE):
+        pass
+
+def check_moves(cell, robot):
+    """
+    Uses RoboDK's collision checking to test every joint and linear move the
+    planned assembly sends to RoboDK, each from the pose the robot is really
+    at when it starts: Home for the first task, and the end of the previous
+    move after that. Moves inside URScript blocks are not tested. Returns
+    (task, move type, target joints) for each move that collides or can not
+    be made.
+    """
+    recorder = MoveRecorder(robot, HOME_POSITION)
+    for task in plan_assembly_order(ASSEMBLY_TASKS, HOME_XY):
+        recorder.task = task
+        ASSEMBLY_TASKS[task].action(cell, recorder)
+    recorder.task = "home"
+    recorder.MoveJ(HOME_POSITION)
+
+    tool, frame = robot.PoseTool(), robot.PoseFrame()
+    def collides(move, start, end):
+        if move == "MoveJ":
+            return robot.MoveJ_Test(start, end) != 0
+        return robot.MoveL_Test(start, robot.SolveFK(end, tool, frame)) != 0
+
+    link = robot.link
+    pairs = enable_collisions(link)
+    try:
+        return [(task, move, end) for task, move, start, end in recorder.moves
+                if collides(move, start, end)]
+    finally:
+        restore_collisions(link, pairs)
+        robot.setJoints(HOME_POSITION)
+
+# ------------------------------------------------------------------
+# Main Program: Assemble the Flashlight
+# ------------------------------------------------------------------
+def main():
+    parser = argparse.ArgumentParser(description="Assemble a flashlight with the UR5 cells in RoboDK.")
+    parser.add_argument("--find-via", action="store_true",
+                        help="Check the endcap-to-pedestal move for collisions and print each cell's endcap_to_ped_via.")
+    parser.add_argument("--check-moves", action="store_true",
+                        help="Check the RoboDK joint and linear moves of the planned assembly for collisions.")
+    parser.add_argument("--bulk", action="store_true",
+                        help="Send each robot's program as one URScript instruction (program generation only).")
+    args = parser.parse_args()
+
+    # Assemble a flashlight in every cell whose robot is in the station
+    robot_names = [name for name in CELLS if RDK.Item(name, ITEM_TYPE_ROBOT).Valid()]
+    if not robot_names:
+        raise RuntimeError("No robot named " + " or ".join(CELLS) + " in the station")
+
+    if args.find_via:
+        for name in robot_names:
+            robot = RDK.Item(name, ITEM_TYPE_ROBOT)
+            print("%s: endcap_to_ped_via = %s" % (name, find_endcap_to_ped_via(CELLS[name], robot)))
+        return
+
+    # Leave out cells whose layout has not been fully calibrated
+    for name in list(robot_names):
+        missing = missing_calibration(CELLS[name])
+        if missing:
+            print("Skipping %s, not calibrated: %s" % (name, ", ".join(missing)))
+            robot_names.remove(name)
+    if not robot_names:
+        raise RuntimeError("No robot in the station has a calibrated cell")
+
+    if args.check_moves:
+        load_ik_cache()
+        for name in robot_names:
+            robot = RDK.Item(name, ITEM_TYPE_ROBOT)
+            print("%s: colliding moves (task, move, target) = %s" % (name, check_moves(CELLS[name], robot)))
+        save_ik_cache()
+        return
+
+    # Refuse to run a plan whose RoboDK joint or linear moves collide, such as
+    # the move from the clamp to Endcap CLR the planned order adds. Moves
+    # inside URScript blocks are not checked.
+    load_ik_cache()
+    for name in robot_names:
+        collisions = check_moves(CELLS[name], RDK.Item(name, ITEM_TYPE_ROBOT))
+        if collisions:
+            raise RuntimeError("%s: moves collide (task, move, target): %s" % (name, collisions))
+
+    run_plan_graph(build_plan_graph(robot_names), args.bulk)
+    save_ik_cache()
+
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()